@@ -1,5 +1,8 @@
+import hmac
 import os
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
 from zoneinfo import ZoneInfo
 from typing import List, Dict
 
@@ -13,9 +16,10 @@ except ImportError:
     qrcode = None
 
 from sqlalchemy import (
-    create_engine, Column, Integer, String, Float, ForeignKey, DateTime, Text, Boolean
+    create_engine, insert, select, Column, Index, Integer, String, Float, ForeignKey, DateTime, Text, Boolean
 )
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, selectinload
+from sqlalchemy.pool import StaticPool
 
 # =============================
 # 基础配置
@@ -37,8 +41,20 @@ ADMIN_PASSWORD = _env("ADMIN_PASSWORD", "changeme")
 TZ = ZoneInfo(_env("APP_TZ", "Asia/Tokyo"))
 FRONTEND_URL = _env("FRONTEND_URL", "")  # 部署后的公开访问地址，用于生成二维码
 
-# SQLite 需要关闭 check_same_thread
-engine_kwargs = {"connect_args": {"check_same_thread": False}} if DATABASE_URL.startswith("sqlite") else {}
+# SQLite 需要关闭 check_same_thread，并用 StaticPool 复用同一连接；
+# PostgreSQL 等显式配置连接池，避免 Streamlit 每次 rerun 重新建连
+if DATABASE_URL.startswith("sqlite"):
+    engine_kwargs = {
+        "connect_args": {"check_same_thread": False},
+        "poolclass": StaticPool,
+    }
+else:
+    engine_kwargs = {
+        "pool_size": 20,
+        "max_overflow": 10,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+    }
 engine = create_engine(DATABASE_URL, echo=False, future=True, **engine_kwargs)
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
 Base = declarative_base()
@@ -51,26 +67,28 @@ class MenuItem(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(200), nullable=False)
     price = Column(Float, nullable=False)
-    category = Column(String(100), nullable=False, default="主菜")
+    category = Column(String(100), nullable=False, default="主菜", index=True)
     description = Column(Text, default="")
     image_url = Column(Text, default="")
-    is_available = Column(Boolean, default=True)
+    is_available = Column(Boolean, default=True, index=True)
 
     order_items = relationship("OrderItem", back_populates="menu_item")
 
 
 class Order(Base):
     __tablename__ = "orders"
+    # 后台按 状态+时间段 组合筛选，给这对列建联合索引
+    __table_args__ = (Index("ix_orders_status_created", "status", "created_at"),)
     id = Column(Integer, primary_key=True)
     customer_name = Column(String(120), default="")
     table_no = Column(String(50), default="")
     contact = Column(String(120), default="")
     note = Column(Text, default="")
-    status = Column(String(20), default="NEW")  # NEW, CONFIRMED, PREPARING, SERVED, CANCELLED
+    status = Column(String(20), default="NEW", index=True)  # NEW, CONFIRMED, PREPARING, SERVED, CANCELLED
     total_price = Column(Float, default=0.0)
     channel = Column(String(50), default="onsite")
     source_ip = Column(String(64), default="")
-    created_at = Column(DateTime, default=lambda: datetime.now(TZ))
+    created_at = Column(DateTime, default=lambda: datetime.now(TZ), index=True)
     updated_at = Column(DateTime, default=lambda: datetime.now(TZ))
 
     items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
@@ -103,6 +121,10 @@ DEFAULT_MENU = [
 
 def init_db():
     Base.metadata.create_all(engine)
+    # create_all 不会给已存在的表补索引，这里单独补建（幂等）
+    for table in (MenuItem.__table__, Order.__table__):
+        for idx in table.indexes:
+            idx.create(engine, checkfirst=True)
     db = SessionLocal()
     try:
         if db.query(MenuItem).count() == 0:
@@ -117,8 +139,14 @@ def init_db():
 # 工具函数
 # =============================
 
+@contextmanager
 def get_db():
-    return SessionLocal()
+    """with get_db() as db: ... 出现异常也保证归还连接，避免连接池泄漏。"""
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
 
 def format_currency(x: float) -> str:
@@ -130,123 +158,152 @@ def ensure_cart():
         st.session_state.cart = {}  # {menu_id: qty}
 
 
-def cart_total(db) -> float:
-    total = 0.0
-    for mid, qty in st.session_state.cart.items():
-        item = db.get(MenuItem, mid)
-        if item and item.is_available:
-            total += item.price * qty
-    return total
+def _get_query_params() -> Dict[str, str]:
+    """URL 参数一个会话内不会变：只解析一次，归一化后存进 session_state。"""
+    if "_qp" not in st.session_state:
+        try:
+            qp = dict(st.query_params)  # 新版 API
+        except Exception:
+            qp = st.experimental_get_query_params()  # 兼容老版本
+        # 老版 API 的值是 list，这里统一成单值
+        st.session_state._qp = {k: (v[0] if isinstance(v, list) else v) for k, v in qp.items()}
+    return st.session_state._qp
+
+
+def _load_items_by_ids(db, ids: List[int]) -> Dict[int, MenuItem]:
+    """一次性按 id 批量加载菜品，避免购物车逐条查询（N+1）。"""
+    if not ids:
+        return {}
+    return {m.id: m for m in db.query(MenuItem).filter(MenuItem.id.in_(ids)).all()}
+
+
+def cart_total(db, cart: Dict[int, int]) -> float:
+    """合计用一条只取 id/price 的查询算出来，不逐条加载 ORM 对象。"""
+    if not cart:
+        return 0.0
+    rows = db.execute(
+        select(MenuItem.id, MenuItem.price).where(
+            MenuItem.id.in_(cart.keys()), MenuItem.is_available == True
+        )
+    ).all()
+    prices = {i: p for i, p in rows}
+    return sum(prices.get(mid, 0.0) * qty for mid, qty in cart.items())
 
 
 def reset_cart():
     st.session_state.cart = {}
 
 
+# 菜单不常变化：缓存查询结果（普通 dict，ORM 对象不适合进缓存），
+# 菜单管理页的任何增删改之后调用 invalidate_menu_cache() 失效
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_categories() -> List[str]:
+    with get_db() as db:
+        return [c[0] for c in db.query(MenuItem.category).distinct().all()]
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_menu(selected_cat: str, search_kw: str) -> List[Dict]:
+    with get_db() as db:
+        q = db.query(MenuItem).filter(MenuItem.is_available == True)
+        if selected_cat and selected_cat != "全部":
+            q = q.filter(MenuItem.category == selected_cat)
+        if search_kw:
+            like = f"%{search_kw}%"
+            q = q.filter((MenuItem.name.ilike(like)) | (MenuItem.description.ilike(like)) | (MenuItem.category.ilike(like)))
+        return [
+            {
+                "id": m.id,
+                "name": m.name,
+                "price": m.price,
+                "category": m.category,
+                "description": m.description,
+                "image_url": m.image_url,
+            }
+            for m in q.order_by(MenuItem.category, MenuItem.name).all()
+        ]
+
+
+def invalidate_menu_cache():
+    fetch_menu.clear()
+    fetch_categories.clear()
+
+
 # =============================
 # 界面：客户点单
 # =============================
 
-def page_order():
-    st.header("🧾 客户点单")
-    db = get_db()
-    ensure_cart()
-
-    # —— 从 URL 读取桌号参数 ?table=XXX，自动填入表单 ——
-    table_param = ""
-    try:
-        # 新版 API
-        qp = dict(st.query_params)
-        if isinstance(qp.get("table"), list):
-            table_param = qp.get("table", [""])[0]
-        else:
-            table_param = qp.get("table", "")
-    except Exception:
-        # 兼容老版本
-        qp = st.experimental_get_query_params()
-        table_param = qp.get("table", [""])[0] if isinstance(qp.get("table"), list) else qp.get("table", "")
-
-    # 分类列表
-    categories = [c[0] for c in db.query(MenuItem.category).distinct().all()]
-    # segmented_control 新版可用；旧版回退为 selectbox
-    if hasattr(st, "segmented_control"):
-        selected_cat = st.segmented_control("分类", options=["全部"] + categories, selection_mode="single")
-    else:
-        selected_cat = st.selectbox("分类", ["全部"] + categories)
-
-    # 菜品卡片 + 搜索 + 布局模式
-    search_kw = st.text_input("搜索菜名/描述", placeholder="例如：牛肉、咖啡")
+def _render_menu_card(m: Dict):
+    """单个菜品卡片（纯展示，数量统一在下方表格编辑）。"""
+    if m["image_url"]:
+        st.image(m["image_url"], use_container_width=True)
+    st.subheader(m["name"])
+    st.caption(m["category"])
+    if m["description"]:
+        st.write(m["description"])
+    st.write(format_currency(m["price"]))
+
+
+@st.fragment
+def _render_menu(items: List[Dict], use_list: bool):
+    """菜品区域做成 fragment：改数量/加购只重跑本区域，不重查整页。
+
+    数量统一在一个 data_editor 里编辑，替代每道菜 2 个小部件
+    （number_input + button）——菜品一多，逐卡片的小部件渲染会明显变慢。
+    """
+    if not items:
+        st.info("没有符合条件的菜品。")
+        return
 
-    # 读取 URL 模式参数：?mode=list 或 ?mobile=1 则默认使用竖向列表（适配手机）
-    layout_default = "grid"
-    try:
-        def _v(x):
-            return str(x).lower() in ("1", "true", "list")
-        if _v(qp.get("mode", "")) or _v(qp.get("mobile", "")):
-            layout_default = "list"
-    except Exception:
-        pass
-    use_list = st.toggle("移动端竖向列表模式", value=(layout_default=="list"))
-
-    q = db.query(MenuItem).filter(MenuItem.is_available == True)
-    if selected_cat and selected_cat != "全部":
-        q = q.filter(MenuItem.category == selected_cat)
-    if search_kw:
-        like = f"%{search_kw}%"
-        q = q.filter((MenuItem.name.ilike(like)) | (MenuItem.description.ilike(like)) | (MenuItem.category.ilike(like)))
-    items = q.order_by(MenuItem.category, MenuItem.name).all()
-
-    if use_list:
-        # 竖向列表（更适配手机）
-        for m in items:
+    # 竖向列表（手机）每行一个容器；网格（桌面）复用 3 列
+    containers = [st.container() for _ in items] if use_list else st.columns(3)
+    for i, m in enumerate(items):
+        with containers[i % len(containers)]:
             with st.container():
-                if m.image_url:
-                    st.image(m.image_url, use_container_width=True)
-                st.subheader(m.name)
-                st.caption(m.category)
-                if m.description:
-                    st.write(m.description)
-                st.write(format_currency(m.price))
-                qty_key = f"qty_{m.id}"
-                default_qty = st.session_state.cart.get(m.id, 0)
-                cols_li = st.columns([2,1])
-                with cols_li[0]:
-                    qty = st.number_input("数量", min_value=0, max_value=50, value=default_qty, step=1, key=qty_key)
-                with cols_li[1]:
-                    if st.button("加入购物车", key=f"add_{m.id}"):
-                        if qty <= 0:
-                            st.warning("数量需要大于 0")
-                        else:
-                            st.session_state.cart[m.id] = qty
-                            st.success(f"已加入：{m.name} × {qty}")
-    else:
-        # 网格（桌面端）
-        cols = st.columns(3)
-        for i, m in enumerate(items):
-            with cols[i % 3]:
-                with st.container():
-                    if m.image_url:
-                        st.image(m.image_url, use_container_width=True)
-                    st.subheader(m.name)
-                    st.caption(m.category)
-                    if m.description:
-                        st.write(m.description)
-                    st.write(format_currency(m.price))
-                    qty_key = f"qty_{m.id}"
-                    default_qty = st.session_state.cart.get(m.id, 0)
-                    qty = st.number_input("数量", min_value=0, max_value=50, value=default_qty, step=1, key=qty_key)
-                    if st.button("加入购物车", key=f"add_{m.id}"):
-                        if qty <= 0:
-                            st.warning("数量需要大于 0")
-                        else:
-                            st.session_state.cart[m.id] = qty
-                            st.success(f"已加入：{m.name} × {qty}")
-
-    st.divider()
+                _render_menu_card(m)
+
+    st.markdown("**选择数量**")
+    df_menu = pd.DataFrame([
+        {
+            "id": m["id"],
+            "名称": m["name"],
+            "分类": m["category"],
+            "价格": m["price"],
+            "数量": st.session_state.cart.get(m["id"], 0),
+        }
+        for m in items
+    ])
+    edited = st.data_editor(
+        df_menu,
+        column_config={
+            "id": None,
+            "价格": st.column_config.NumberColumn(format="¥%.2f"),
+            "数量": st.column_config.NumberColumn(min_value=0, max_value=50, step=1),
+        },
+        disabled=["名称", "分类", "价格"],
+        hide_index=True,
+        use_container_width=True,
+    )
+    # 只同步当前筛选下展示的菜品；其它筛选条件下加入的保持不变
+    shown_ids = {m["id"] for m in items}
+    cart = {mid: q for mid, q in st.session_state.cart.items() if mid not in shown_ids}
+    cart.update({int(r["id"]): int(r["数量"]) for _, r in edited.iterrows() if r["数量"] > 0})
+    if cart != st.session_state.cart:
+        st.session_state.cart = cart
+        st.rerun(scope="app")  # 购物车在 fragment 之外，整页刷新一次
+
+
+@st.fragment
+def _render_cart():
+    """购物车区域 fragment：清空等操作只重跑本区域。"""
     st.subheader("🛒 购物车")
+    # 批量加载购物车中的菜品，明细展示用；合计在 SQL 里算
+    with get_db() as db:
+        items_by_id = _load_items_by_ids(db, list(st.session_state.cart.keys()))
+        total = cart_total(db, st.session_state.cart)
     cart_rows = []
     for mid, qty in st.session_state.cart.items():
-        item = db.get(MenuItem, mid)
+        item = items_by_id.get(mid)
         if not item:
             continue
         cart_rows.append({
@@ -258,167 +315,222 @@ def page_order():
     if cart_rows:
         df_cart = pd.DataFrame(cart_rows)
         st.dataframe(df_cart, use_container_width=True, hide_index=True)
-        st.markdown(f"**合计：{format_currency(cart_total(db))}**")
+        st.markdown(f"**合计：{format_currency(total)}**")
         c1, c2 = st.columns(2)
         with c1:
             if st.button("清空购物车", type="secondary"):
                 reset_cart()
-                st.rerun()
+                st.rerun(scope="app")
     else:
         st.info("购物车为空，先选择菜品加入吧！")
 
-    st.subheader("📋 联系信息")
-    with st.form("place_order"):
-        customer_name = st.text_input("姓名/昵称", placeholder="可选")
-        table_no = st.text_input("桌号/房间号", value=table_param or "", placeholder="如 A3 或 外卖")
-        contact = st.text_input("联系方式", placeholder="电话或微信（可选）")
-        note = st.text_area("备注", placeholder="口味/过敏/打包等")
-        submitted = st.form_submit_button("提交订单", type="primary", use_container_width=True)
-
-        if submitted:
-            if not st.session_state.cart:
-                st.warning("购物车为空！")
-            else:
-                # 创建订单
-                order = Order(
-                    customer_name=customer_name.strip(),
-                    table_no=table_no.strip(),
-                    contact=contact.strip(),
-                    note=note.strip(),
-                    status="NEW",
-                    total_price=0.0,
-                    channel="onsite",
-                    source_ip=os.environ.get("X_FORWARDED_FOR", "") or os.environ.get("REMOTE_ADDR", ""),
-                    created_at=datetime.now(TZ),
-                    updated_at=datetime.now(TZ),
-                )
-                db.add(order)
-                db.flush()  # 获取 order.id
-
-                total = 0.0
-                for mid, qty in st.session_state.cart.items():
-                    item = db.get(MenuItem, mid)
-                    if not item:
-                        continue
-                    total += item.price * qty
-                    db.add(OrderItem(
-                        order_id=order.id,
-                        item_id=item.id,
-                        item_name=item.name,
-                        unit_price=item.price,
-                        quantity=qty,
-                    ))
-                order.total_price = total
-                order.updated_at = datetime.now(TZ)
-                db.commit()
-                reset_cart()
-                st.success(f"下单成功！订单号 #{order.id}，金额 {format_currency(total)}")
-                st.balloons()
 
-    db.close()
+def page_order():
+    st.header("🧾 客户点单")
+    with get_db() as db:
+        ensure_cart()
+
+        # —— 从 URL 读取桌号参数 ?table=XXX，自动填入表单 ——
+        qp = _get_query_params()
+        table_param = qp.get("table", "")
+
+        # 分类列表
+        categories = fetch_categories()
+        # segmented_control 新版可用；旧版回退为 selectbox
+        if hasattr(st, "segmented_control"):
+            selected_cat = st.segmented_control("分类", options=["全部"] + categories, selection_mode="single")
+        else:
+            selected_cat = st.selectbox("分类", ["全部"] + categories)
+
+        # 菜品卡片 + 搜索 + 布局模式
+        search_kw = st.text_input("搜索菜名/描述", placeholder="例如：牛肉、咖啡")
+
+        # 读取 URL 模式参数：?mode=list 或 ?mobile=1 则默认使用竖向列表（适配手机）
+        def _v(x):
+            return str(x).lower() in ("1", "true", "list")
+        layout_default = "list" if _v(qp.get("mode", "")) or _v(qp.get("mobile", "")) else "grid"
+        use_list = st.toggle("移动端竖向列表模式", value=(layout_default=="list"))
+
+        items = fetch_menu(selected_cat or "全部", search_kw)
+
+        _render_menu(items, use_list)
+
+        st.divider()
+        _render_cart()
+
+        st.subheader("📋 联系信息")
+        with st.form("place_order"):
+            customer_name = st.text_input("姓名/昵称", placeholder="可选")
+            table_no = st.text_input("桌号/房间号", value=table_param or "", placeholder="如 A3 或 外卖")
+            contact = st.text_input("联系方式", placeholder="电话或微信（可选）")
+            note = st.text_area("备注", placeholder="口味/过敏/打包等")
+            submitted = st.form_submit_button("提交订单", type="primary", use_container_width=True)
+
+            if submitted:
+                if not st.session_state.cart:
+                    st.warning("购物车为空！")
+                else:
+                    items_by_id = _load_items_by_ids(db, list(st.session_state.cart.keys()))
+                    # 创建订单
+                    order = Order(
+                        customer_name=customer_name.strip(),
+                        table_no=table_no.strip(),
+                        contact=contact.strip(),
+                        note=note.strip(),
+                        status="NEW",
+                        total_price=0.0,
+                        channel="onsite",
+                        source_ip=os.environ.get("X_FORWARDED_FOR", "") or os.environ.get("REMOTE_ADDR", ""),
+                        created_at=datetime.now(TZ),
+                        updated_at=datetime.now(TZ),
+                    )
+                    db.add(order)
+                    db.flush()  # 获取 order.id
+
+                    # 一条多行 INSERT 批量写入订单明细，而不是逐条 db.add
+                    rows = [
+                        {
+                            "order_id": order.id,
+                            "item_id": item.id,
+                            "item_name": item.name,
+                            "unit_price": item.price,
+                            "quantity": qty,
+                        }
+                        for mid, qty in st.session_state.cart.items()
+                        if (item := items_by_id.get(mid))
+                    ]
+                    if rows:
+                        db.execute(insert(OrderItem), rows)
+                    total = sum(r["unit_price"] * r["quantity"] for r in rows)
+                    order.total_price = total
+                    order.updated_at = datetime.now(TZ)
+                    db.commit()
+                    reset_cart()
+                    st.success(f"下单成功！订单号 #{order.id}，金额 {format_currency(total)}")
+                    st.balloons()
+
 
 
 # =============================
 # 界面：查看订单（后台）
 # =============================
 
+@st.fragment
+def _order_detail(order_ids: List[int]):
+    """订单详情 fragment：切换订单只补查这一单，不重跑整页筛选查询。"""
+    oid = st.selectbox("选择订单", options=order_ids, format_func=lambda x: f"#{x}")
+    with get_db() as db:
+        order = db.get(Order, oid, options=[selectinload(Order.items)])
+        if not order:
+            st.info("订单不存在（可能已被删除）。")
+            return
+        st.markdown(f"**订单号：** #{order.id}")
+        st.markdown(f"**创建时间：** {order.created_at.astimezone(TZ).strftime('%Y-%m-%d %H:%M:%S')}  ")
+        st.markdown(f"**客户：** {order.customer_name}  |  **桌号：** {order.table_no}  |  **联系方式：** {order.contact}")
+        if order.note:
+            st.markdown(f"**备注：** {order.note}")
+        st.markdown("**菜品**：")
+        items_df = pd.DataFrame([
+            {
+                "菜品": it.item_name,
+                "单价": format_currency(it.unit_price),
+                "数量": it.quantity,
+                "小计": format_currency(it.unit_price * it.quantity),
+            }
+            for it in order.items
+        ])
+        st.dataframe(items_df, use_container_width=True, hide_index=True)
+        st.markdown(f"**合计：{format_currency(order.total_price)}**")
+
+        new_status = st.selectbox(
+            "更新状态",
+            options=["NEW", "CONFIRMED", "PREPARING", "SERVED", "CANCELLED"],
+            index=["NEW", "CONFIRMED", "PREPARING", "SERVED", "CANCELLED"].index(order.status),
+        )
+        if st.button("保存状态"):
+            order.status = new_status
+            order.updated_at = datetime.now(TZ)
+            db.commit()
+            st.success("已更新订单状态")
+            st.rerun()
+
+        if st.button("删除该订单", type="secondary"):
+            db.delete(order)
+            db.commit()
+            st.warning("订单已删除")
+            st.rerun()
+
+
 def page_orders_admin():
     st.header("📦 订单管理（后台）")
-    db = get_db()
-
-    with st.expander("筛选", expanded=True):
-        cols = st.columns(4)
-        with cols[0]:
-            statuses = ["NEW", "CONFIRMED", "PREPARING", "SERVED", "CANCELLED"]
-            status_sel = st.multiselect("状态", statuses, default=statuses)
-        with cols[1]:
-            d_from = st.date_input("开始日期", value=datetime.now(TZ).date())
-        with cols[2]:
-            d_to = st.date_input("结束日期", value=datetime.now(TZ).date())
-        with cols[3]:
-            keyword = st.text_input("关键词", placeholder="姓名/桌号/联系方式")
-
-    q = db.query(Order)
-    q = q.filter(Order.created_at >= datetime(d_from.year, d_from.month, d_from.day, 0, 0, tzinfo=TZ))
-    q = q.filter(Order.created_at <= datetime(d_to.year, d_to.month, d_to.day, 23, 59, 59, tzinfo=TZ))
-    if status_sel:
-        q = q.filter(Order.status.in_(status_sel))
-    if keyword:
-        like = f"%{keyword}%"
-        q = q.filter((Order.customer_name.ilike(like)) | (Order.table_no.ilike(like)) | (Order.contact.ilike(like)))
-
-    q = q.order_by(Order.created_at.desc())
-    orders: List[Order] = q.all()
-
-    # 汇总表
-    rows = []
-    for o in orders:
-        rows.append({
-            "订单号": o.id,
-            "时间": o.created_at.astimezone(TZ).strftime("%Y-%m-%d %H:%M"),
-            "姓名": o.customer_name,
-            "桌号": o.table_no,
-            "状态": o.status,
-            "金额": o.total_price,
-        })
-    df = pd.DataFrame(rows)
-    if not df.empty:
-        df_display = df.copy()
-        df_display["金额"] = df_display["金额"].map(format_currency)
-        st.dataframe(df_display, use_container_width=True, hide_index=True)
-    else:
-        st.info("没有订单。")
+    with get_db() as db:
+
+        with st.expander("筛选", expanded=True):
+            cols = st.columns(4)
+            with cols[0]:
+                statuses = ["NEW", "CONFIRMED", "PREPARING", "SERVED", "CANCELLED"]
+                status_sel = st.multiselect("状态", statuses, default=statuses)
+            with cols[1]:
+                d_from = st.date_input("开始日期", value=datetime.now(TZ).date())
+            with cols[2]:
+                d_to = st.date_input("结束日期", value=datetime.now(TZ).date())
+            with cols[3]:
+                keyword = st.text_input("关键词", placeholder="姓名/桌号/联系方式")
+
+        # 半开区间 [start, end)：不会漏掉 23:59:59 之后的订单，范围扫描也更索引友好
+        start = datetime.combine(d_from, time.min, TZ)
+        end = datetime.combine(d_to + timedelta(days=1), time.min, TZ)
+        conds = [Order.created_at >= start, Order.created_at < end]
+        if status_sel:
+            conds.append(Order.status.in_(status_sel))
+        if keyword:
+            like = f"%{keyword}%"
+            conds.append((Order.customer_name.ilike(like)) | (Order.table_no.ilike(like)) | (Order.contact.ilike(like)))
+
+        # 汇总表只做展示，直接让 pandas 从游标取列，不经过 ORM 对象
+        # （详情 fragment 自己按需补查单个订单及其 items）
+        stmt = (
+            select(
+                Order.id.label("订单号"),
+                Order.created_at.label("时间"),
+                Order.customer_name.label("姓名"),
+                Order.table_no.label("桌号"),
+                Order.status.label("状态"),
+                Order.total_price.label("金额"),
+            )
+            .where(*conds)
+            .order_by(Order.created_at.desc())
+        )
+        df = pd.read_sql(stmt, db.connection())
+        if not df.empty:
+            # 时间列整列转换一次，替代逐行 astimezone + strftime
+            ts = pd.to_datetime(df["时间"])
+            if ts.dt.tz is None:
+                ts = ts.dt.tz_localize(datetime.now().astimezone().tzinfo)
+            df["时间"] = ts.dt.tz_convert(TZ).dt.strftime("%Y-%m-%d %H:%M")
+            # 金额列交给前端按格式渲染，省掉整表复制 + 逐行 Python 格式化
+            st.dataframe(
+                df,
+                column_config={"金额": st.column_config.NumberColumn(format="¥%.2f")},
+                use_container_width=True,
+                hide_index=True,
+            )
+        else:
+            st.info("没有订单。")
 
-    c1, c2 = st.columns(2)
-    with c1:
-        if st.button("导出为 CSV"):
-            csv = df.to_csv(index=False).encode("utf-8-sig")
-            st.download_button("下载订单.csv", csv, file_name="orders_export.csv", mime="text/csv")
+        c1, c2 = st.columns(2)
+        with c1:
+            if st.button("导出为 CSV"):
+                buf = BytesIO()
+                df.to_csv(buf, index=False, encoding="utf-8-sig")
+                st.download_button("下载订单.csv", buf.getvalue(), file_name="orders_export.csv", mime="text/csv")
 
-    st.divider()
-    st.subheader("订单详情 / 快速更新")
-
-    if orders:
-        oid = st.selectbox("选择订单", options=[o.id for o in orders], format_func=lambda x: f"#{x}")
-        order = next((o for o in orders if o.id == oid), None)
-        if order:
-            st.markdown(f"**订单号：** #{order.id}")
-            st.markdown(f"**创建时间：** {order.created_at.astimezone(TZ).strftime('%Y-%m-%d %H:%M:%S')}  ")
-            st.markdown(f"**客户：** {order.customer_name}  |  **桌号：** {order.table_no}  |  **联系方式：** {order.contact}")
-            if order.note:
-                st.markdown(f"**备注：** {order.note}")
-            st.markdown("**菜品**：")
-            items_df = pd.DataFrame([
-                {
-                    "菜品": it.item_name,
-                    "单价": format_currency(it.unit_price),
-                    "数量": it.quantity,
-                    "小计": format_currency(it.unit_price * it.quantity),
-                }
-                for it in order.items
-            ])
-            st.dataframe(items_df, use_container_width=True, hide_index=True)
-            st.markdown(f"**合计：{format_currency(order.total_price)}**")
-
-            new_status = st.selectbox(
-                "更新状态",
-                options=["NEW", "CONFIRMED", "PREPARING", "SERVED", "CANCELLED"],
-                index=["NEW", "CONFIRMED", "PREPARING", "SERVED", "CANCELLED"].index(order.status),
-            )
-            if st.button("保存状态"):
-                order.status = new_status
-                order.updated_at = datetime.now(TZ)
-                db.commit()
-                st.success("已更新订单状态")
-                st.rerun()
+        st.divider()
+        st.subheader("订单详情 / 快速更新")
 
-            if st.button("删除该订单", type="secondary"):
-                db.delete(order)
-                db.commit()
-                st.warning("订单已删除")
-                st.rerun()
+        if not df.empty:
+            _order_detail(df["订单号"].tolist())
 
-    db.close()
 
 
 # =============================
@@ -427,114 +539,119 @@ def page_orders_admin():
 
 def page_menu_admin():
     st.header("📚 菜单管理（后台）")
-    db = get_db()
-
-    st.subheader("当前菜单")
-    data = []
-    for m in db.query(MenuItem).order_by(MenuItem.category, MenuItem.name).all():
-        data.append({
-            "ID": m.id,
-            "名称": m.name,
-            "分类": m.category,
-            "价格": m.price,
-            "是否上架": m.is_available,
-            "描述": m.description,
-            "图片URL": m.image_url,
-        })
-    df = pd.DataFrame(data)
-    st.dataframe(df, use_container_width=True)
-
-    st.divider()
-    st.subheader("新增菜品")
-    with st.form("add_item"):
-        name = st.text_input("名称")
-        category = st.text_input("分类", value="主食")
-        price = st.number_input("价格", min_value=0.0, step=0.5)
-        description = st.text_area("描述", placeholder="可选")
-        image_url = st.text_input("图片URL", placeholder="可选")
-        avail = st.checkbox("上架", value=True)
-        ok = st.form_submit_button("添加", type="primary")
-        if ok:
-            if not name:
-                st.warning("名称必填")
-            else:
-                db.add(MenuItem(name=name, category=category or "主食", price=float(price),
-                                description=description, image_url=image_url, is_available=avail))
-                db.commit()
-                st.success("已添加")
-                st.rerun()
+    with get_db() as db:
+
+        st.subheader("当前菜单")
+        data = []
+        for m in db.query(MenuItem).order_by(MenuItem.category, MenuItem.name).all():
+            data.append({
+                "ID": m.id,
+                "名称": m.name,
+                "分类": m.category,
+                "价格": m.price,
+                "是否上架": m.is_available,
+                "描述": m.description,
+                "图片URL": m.image_url,
+            })
+        df = pd.DataFrame(data)
+        st.dataframe(df, use_container_width=True)
+
+        st.divider()
+        st.subheader("新增菜品")
+        with st.form("add_item"):
+            name = st.text_input("名称")
+            category = st.text_input("分类", value="主食")
+            price = st.number_input("价格", min_value=0.0, step=0.5)
+            description = st.text_area("描述", placeholder="可选")
+            image_url = st.text_input("图片URL", placeholder="可选")
+            avail = st.checkbox("上架", value=True)
+            ok = st.form_submit_button("添加", type="primary")
+            if ok:
+                if not name:
+                    st.warning("名称必填")
+                else:
+                    db.add(MenuItem(name=name, category=category or "主食", price=float(price),
+                                    description=description, image_url=image_url, is_available=avail))
+                    db.commit()
+                    invalidate_menu_cache()
+                    st.success("已添加")
+                    st.rerun()
+
+        st.divider()
+        st.subheader("编辑 / 下架 / 删除")
+        all_items = db.query(MenuItem).order_by(MenuItem.category, MenuItem.name).all()
+        if all_items:
+            selected = st.selectbox("选择菜品", options=all_items, format_func=lambda m: f"[{m.category}] {m.name} (¥{m.price})")
+            if selected:
+                with st.form("edit_item"):
+                    e_name = st.text_input("名称", value=selected.name)
+                    e_category = st.text_input("分类", value=selected.category)
+                    e_price = st.number_input("价格", min_value=0.0, step=0.5, value=float(selected.price))
+                    e_desc = st.text_area("描述", value=selected.description)
+                    e_img = st.text_input("图片URL", value=selected.image_url)
+                    e_avail = st.checkbox("上架", value=bool(selected.is_available))
+                    c1, c2, c3 = st.columns(3)
+                    with c1:
+                        save_ok = st.form_submit_button("保存修改", type="primary")
+                    with c2:
+                        del_ok = st.form_submit_button("删除该菜品", type="secondary")
+                    with c3:
+                        pass
+
+                if save_ok:
+                    selected.name = e_name
+                    selected.category = e_category
+                    selected.price = float(e_price)
+                    selected.description = e_desc
+                    selected.image_url = e_img
+                    selected.is_available = e_avail
+                    db.commit()
+                    invalidate_menu_cache()
+                    st.success("已更新")
+                    st.rerun()
+
+                if del_ok:
+                    db.delete(selected)
+                    db.commit()
+                    invalidate_menu_cache()
+                    st.warning("已删除")
+                    st.rerun()
+        else:
+            st.info("暂无菜品，请先新增。")
+
+        st.divider()
+        st.subheader("批量导入菜品（CSV）")
+        st.caption("CSV 需要包含列：name,price,category,description,image_url,is_available（可选）")
+        up = st.file_uploader("上传 CSV", type=["csv"])
+        if up is not None:
+            try:
+                # 显式 dtype，省掉 pandas 的类型推断
+                dfu = pd.read_csv(up, dtype={"name": str, "category": str, "description": str, "image_url": str})
+                required = {"name", "price", "category"}
+                if not required.issubset(set(map(str.lower, dfu.columns))):
+                    st.error("CSV 至少包含 name, price, category 列")
+                else:
+                    # 统一列名到小写，整列做类型/默认值处理，再一次性批量插入
+                    dfu.columns = [c.lower() for c in dfu.columns]
+                    records = [
+                        {
+                            "name": str(row.get("name", "")).strip(),
+                            "price": float(row.get("price", 0.0)),
+                            "category": str(row.get("category", "主食")),
+                            "description": str(row.get("description", "")),
+                            "image_url": str(row.get("image_url", "")),
+                            "is_available": bool(row.get("is_available", True)),
+                        }
+                        for row in dfu.to_dict("records")
+                    ]
+                    db.bulk_insert_mappings(MenuItem, records)
+                    db.commit()
+                    invalidate_menu_cache()
+                    st.success(f"已导入 {len(records)} 条")
+                    st.rerun()
+            except Exception as e:
+                st.error(f"导入失败：{e}")
 
-    st.divider()
-    st.subheader("编辑 / 下架 / 删除")
-    all_items = db.query(MenuItem).order_by(MenuItem.category, MenuItem.name).all()
-    if all_items:
-        selected = st.selectbox("选择菜品", options=all_items, format_func=lambda m: f"[{m.category}] {m.name} (¥{m.price})")
-        if selected:
-            with st.form("edit_item"):
-                e_name = st.text_input("名称", value=selected.name)
-                e_category = st.text_input("分类", value=selected.category)
-                e_price = st.number_input("价格", min_value=0.0, step=0.5, value=float(selected.price))
-                e_desc = st.text_area("描述", value=selected.description)
-                e_img = st.text_input("图片URL", value=selected.image_url)
-                e_avail = st.checkbox("上架", value=bool(selected.is_available))
-                c1, c2, c3 = st.columns(3)
-                with c1:
-                    save_ok = st.form_submit_button("保存修改", type="primary")
-                with c2:
-                    del_ok = st.form_submit_button("删除该菜品", type="secondary")
-                with c3:
-                    pass
-
-            if save_ok:
-                selected.name = e_name
-                selected.category = e_category
-                selected.price = float(e_price)
-                selected.description = e_desc
-                selected.image_url = e_img
-                selected.is_available = e_avail
-                db.commit()
-                st.success("已更新")
-                st.rerun()
-
-            if del_ok:
-                db.delete(selected)
-                db.commit()
-                st.warning("已删除")
-                st.rerun()
-    else:
-        st.info("暂无菜品，请先新增。")
-
-    st.divider()
-    st.subheader("批量导入菜品（CSV）")
-    st.caption("CSV 需要包含列：name,price,category,description,image_url,is_available（可选）")
-    up = st.file_uploader("上传 CSV", type=["csv"])
-    if up is not None:
-        try:
-            dfu = pd.read_csv(up)
-            required = {"name", "price", "category"}
-            if not required.issubset(set(map(str.lower, dfu.columns))):
-                st.error("CSV 至少包含 name, price, category 列")
-            else:
-                # 统一列名到小写
-                dfu.columns = [c.lower() for c in dfu.columns]
-                n = 0
-                for _, r in dfu.iterrows():
-                    db.add(MenuItem(
-                        name=str(r.get("name", "")).strip(),
-                        price=float(r.get("price", 0.0)),
-                        category=str(r.get("category", "主食")),
-                        description=str(r.get("description", "")),
-                        image_url=str(r.get("image_url", "")),
-                        is_available=bool(r.get("is_available", True)),
-                    ))
-                    n += 1
-                db.commit()
-                st.success(f"已导入 {n} 条")
-                st.rerun()
-        except Exception as e:
-            st.error(f"导入失败：{e}")
-
-    db.close()
 
 
 # =============================
@@ -542,19 +659,65 @@ def page_menu_admin():
 # =============================
 
 def require_admin() -> bool:
+    # 已登录直接放行，不再每次 rerun 都渲染密码输入框
+    if st.session_state.get("_admin_ok"):
+        st.sidebar.success("✅ 已登录后台")
+        if st.sidebar.button("退出"):
+            st.session_state["_admin_ok"] = False
+            st.rerun()
+        return True
     st.sidebar.markdown("### 🔐 后台登录")
     pw = st.sidebar.text_input("管理员密码", type="password")
-    ok = st.sidebar.button("进入后台")
-    if ok:
-        st.session_state.get("_admin_ok")
-        st.session_state["_admin_ok"] = (pw == ADMIN_PASSWORD)
-    return st.session_state.get("_admin_ok", False)
+    if st.sidebar.button("进入后台"):
+        # compare_digest 不接受含非 ASCII 字符的 str，统一按 UTF-8 字节比较
+        if hmac.compare_digest(pw.encode("utf-8"), ADMIN_PASSWORD.encode("utf-8")):
+            st.session_state["_admin_ok"] = True
+            st.rerun()
+        else:
+            st.sidebar.error("密码错误")
+    return False
 
 
 # =============================
 # 二维码页面（后台）
 # =============================
 
+def _qr_version_for(url: str) -> int:
+    """用最长的 URL 试编码一次，确定批量共用的二维码版本。"""
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, border=2)
+    qr.add_data(url)
+    qr.make(fit=True)
+    return qr.version
+
+
+_worker_qr = None  # 每个子进程各自持有一个复用的 QRCode 实例
+
+
+def _gen_qr(args):
+    """进程池 worker：生成单个二维码，返回 (桌号, PNG bytes)。
+
+    版本由父进程按最长 URL 预先定好，fit=False 跳过逐个 URL 的版本搜索；
+    纠错级别用 L（桌贴二维码够用，计算量最小）。
+    """
+    global _worker_qr
+    tid, url, version = args
+    if _worker_qr is None or _worker_qr.version != version:
+        _worker_qr = qrcode.QRCode(
+            version=version,
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=10,
+            border=2,
+        )
+    qr = _worker_qr
+    qr.clear()
+    qr.add_data(url)
+    qr.make(fit=False)
+    img = qr.make_image()
+    bio = BytesIO()
+    img.save(bio, format="PNG")
+    return tid, bio.getvalue()
+
+
 def page_qr():
     st.header("📱 桌贴二维码生成（后台）")
     if qrcode is None:
@@ -569,20 +732,25 @@ def page_qr():
     param_key = st.text_input("桌号参数名", value="table", help="二维码将以 ?table=XXX 的形式附加到链接")
     mobile_mode = st.checkbox("二维码启用移动端列表布局（mode=list）", value=True)
 
+    # URL 模板只拼一次，单个/批量两个入口共用
+    base = base_url.rstrip("/")
+    suffix = "&mode=list" if mobile_mode else ""
+
     st.divider()
 
     # 2) 单个桌号二维码
     st.subheader("单个桌号")
     single_table = st.text_input("桌号（如 A3）", value="A1")
     if st.button("生成单个二维码"):
-        url = base_url.rstrip("/") + f"/?{param_key}={single_table}" + ("&mode=list" if mobile_mode else "")
+        url = f"{base}/?{param_key}={single_table}{suffix}"
         img = qrcode.make(url)
         bio = BytesIO()
         img.save(bio, format="PNG")
-        st.image(bio.getvalue(), caption=url, use_container_width=False)
+        png = bio.getvalue()  # 只取一次字节，预览和下载共用
+        st.image(png, caption=url, use_container_width=False)
         st.download_button(
             "下载该二维码PNG",
-            data=bio.getvalue(),
+            data=png,
             file_name=f"qr_{single_table}.png",
             mime="image/png",
         )
@@ -600,15 +768,19 @@ def page_qr():
         count = st.number_input("数量", min_value=1, value=10, step=1)
 
     if st.button("批量生成ZIP"):
+        urls = [
+            (f"{prefix}{i}", f"{base}/?{param_key}={prefix}{i}{suffix}")
+            for i in range(int(start_no), int(start_no) + int(count))
+        ]
+        version = _qr_version_for(max(urls, key=lambda t: len(t[1]))[1])
+        jobs = [(tid, url, version) for tid, url in urls]
         zbio = BytesIO()
-        with zipfile.ZipFile(zbio, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-            for i in range(int(start_no), int(start_no) + int(count)):
-                tid = f"{prefix}{i}"
-                url = base_url.rstrip("/") + f"/?{param_key}={tid}" + ("&mode=list" if mobile_mode else "")
-                img = qrcode.make(url)
-                bio = BytesIO()
-                img.save(bio, format="PNG")
-                zf.writestr(f"qr_{tid}.png", bio.getvalue())
+        # 二维码编码是 CPU 密集且相互独立，丢进进程池并行生成；
+        # PNG 本身已是 DEFLATE 压缩，打包直接 STORED，省掉二次压缩
+        with zipfile.ZipFile(zbio, mode="w", compression=zipfile.ZIP_STORED) as zf:
+            with ProcessPoolExecutor() as ex:
+                for tid, png in ex.map(_gen_qr, jobs, chunksize=8):
+                    zf.writestr(f"qr_{tid}.png", png)
         st.success(f"已生成 {int(count)} 个二维码")
         st.download_button("下载二维码打包ZIP", data=zbio.getvalue(), file_name="qrs.zip", mime="application/zip")
 